@@ -0,0 +1,207 @@
+import numpy as np
+from stable_baselines.common.vec_env import VecEnv
+
+from environment import MEAN_START_SKILL_LEVEL, PROPER_LEARNING_TYPE_REWARD, REVIEW_RATIO, \
+    REWARD_FOR_ACHIEVING_ALL_LEVELS, STD_START_SKILL_LEVEL, STUDENT_SKILL_GAIN_STD, TARGET_SCORE, TEST_SCORE_STD, \
+    _get_action_space, _get_mean_skills_gains, _get_observation_space, _get_test_mean, _get_test_reward, \
+    _get_trained_skill
+from kernels import estimate_skills_nb, proper_difficulty_nb
+
+
+# StudentEnv for num_envs students at once: every state array has a leading batch dimension.
+# Finished students are reset automatically, as stable-baselines expects from a VecEnv.
+class StudentEnvBatched(VecEnv):
+    # state with one row per student, every other attribute is shared by the whole batch
+    _BATCHED_ATTRS = ('skills_levels', 'scores', 'gains', 'num_trainings', 'type_gains', 'mean_skill_gains',
+                      '_best_learning_type', 'cumulative_train_time', 'train_counter', '_type_sum', 'episode',
+                      'step_num')
+    # methods that act on every student at once and return one result per student
+    _BATCH_METHODS = ('seed',)
+
+    def __init__(self, num_envs, num_subjects=3, num_difficulty_levels=3, num_learning_types=3, seed=None):
+        super(StudentEnvBatched, self).__init__(
+            num_envs,
+            _get_observation_space(num_subjects, num_difficulty_levels, num_learning_types),
+            _get_action_space(num_subjects, num_difficulty_levels, num_learning_types)
+        )
+        self.seed(seed)
+        self.difficulties_levels = num_difficulty_levels
+        self.learning_type_number = num_learning_types
+        self.num_subjects = num_subjects
+        self.difficulties_thresholds = np.linspace(0, 100, num=num_difficulty_levels, endpoint=False)
+        self.difficulties_thresholds.setflags(write=False)
+        self.review_ratio = 1 / (num_difficulty_levels + 1)
+        self.skills_levels = np.maximum(
+            self._rng.normal(MEAN_START_SKILL_LEVEL, STD_START_SKILL_LEVEL, size=(num_envs, num_subjects)), 0
+        )
+        self.scores = np.zeros((num_envs, num_subjects, num_difficulty_levels), dtype=np.float32)
+        self.gains = np.zeros((num_envs, num_subjects, num_difficulty_levels), dtype=np.float32)
+        self.num_trainings = np.zeros((num_envs, num_subjects, num_difficulty_levels, num_learning_types),
+                                      dtype=np.float32)
+        self.type_gains = np.zeros((num_envs, num_subjects, num_difficulty_levels, num_learning_types),
+                                   dtype=np.float32)
+        self.mean_skill_gains = np.stack(
+            [_get_mean_skills_gains(num_subjects, num_learning_types, self._rng) for _ in range(num_envs)])
+        self._best_learning_type = np.argmax(self.mean_skill_gains.sum(axis=1), axis=1)
+        self.cumulative_train_time = np.zeros((num_envs, num_subjects))
+        self.train_counter = np.zeros((num_envs, num_subjects, num_difficulty_levels, num_learning_types))
+        self._type_sum = np.zeros((num_envs, num_learning_types))
+        self.episode = np.zeros(num_envs, dtype=int)
+        self.step_num = np.zeros(num_envs, dtype=int)
+        self._actions = None
+        # compile numba kernels here rather than on the first step
+        estimate_skills_nb(self.scores[0], REVIEW_RATIO)
+        proper_difficulty_nb(np.zeros(num_envs), self.difficulties_thresholds)
+
+    def step_async(self, actions):
+        self._actions = np.asarray(actions)
+
+    def step_wait(self):
+        is_test, subject, test_difficulty, learning_type, learning_difficulty = self._actions.T
+        is_test = is_test.astype(bool)
+        test_envs = np.flatnonzero(is_test)
+        train_envs = np.flatnonzero(~is_test)
+        rewards = np.zeros(self.num_envs)
+        dones = np.zeros(self.num_envs, dtype=bool)
+
+        rewards[test_envs] = self._test(test_envs, subject[test_envs], test_difficulty[test_envs])
+        self.cumulative_train_time[test_envs, subject[test_envs]] = 0
+        dones[test_envs] = (self.scores[test_envs, :, -1] > TARGET_SCORE).all(axis=1)
+        rewards[dones] += REWARD_FOR_ACHIEVING_ALL_LEVELS
+        rewards[train_envs] = self._train(train_envs, subject[train_envs], learning_type[train_envs],
+                                          learning_difficulty[train_envs])
+
+        rewards += - np.sqrt(self.step_num)
+        self.step_num += 1
+        infos = [{} for _ in range(self.num_envs)]
+        done_envs = np.flatnonzero(dones)
+        if len(done_envs):
+            terminal_observations = self.observation[done_envs]
+            for env_idx, terminal_observation in zip(done_envs, terminal_observations):
+                infos[env_idx]['terminal_observation'] = terminal_observation
+        self._reset_envs(done_envs)
+        return self.observation, rewards, dones, infos
+
+    def _test(self, envs, subject, difficulty):
+        test_mean = self._get_test_mean(envs, subject, difficulty)
+        previous_score = self.scores[envs, subject, difficulty]
+        previous_estimated_skill = self._estimate_skills(envs, subject)
+        sampled_test_score = np.clip(self._rng.normal(test_mean, TEST_SCORE_STD), 0, 100)
+        self.gains[envs, subject, difficulty] = sampled_test_score - previous_score
+        self.scores[envs, subject, difficulty] = sampled_test_score
+        estimated_improvement = self._estimate_skills(envs, subject) - \
+                                previous_estimated_skill
+        mean_type_gain = self._get_mean_type_gain(envs, subject, difficulty, estimated_improvement)
+        type_gains = self.type_gains[envs]
+        type_gains[np.arange(len(envs)), subject] = mean_type_gain[:, None, :]
+        type_gains = (type_gains + 0.5 * mean_type_gain[:, None, None, :]) / 1.5
+        self.type_gains[envs] = type_gains
+        if PROPER_LEARNING_TYPE_REWARD:
+            self._type_sum[envs] = type_gains.sum(axis=(1, 2))
+
+        self.num_trainings[envs, subject, difficulty] = 0
+        return _get_test_reward(sampled_test_score, previous_score, self.cumulative_train_time[envs, subject],
+                                difficulty, self.difficulties_levels, self.step_num[envs])
+
+    def _estimate_skills(self, envs, subject):
+        # one row of test scores per env, only for the subject that is tested
+        return estimate_skills_nb(self.scores[envs, subject], REVIEW_RATIO)
+
+    def _get_mean_type_gain(self, envs, subject, difficulty, estimated_improvement):
+        num_trainings_since_last_test = self.num_trainings[envs, subject, difficulty]
+        last_avg = self.type_gains[envs, subject, difficulty]
+        train_counter = self.train_counter[envs, subject, difficulty]
+        total_trainings = num_trainings_since_last_test.sum(axis=1)
+        was_trained = total_trainings > 0
+        total_trainings = np.where(was_trained, total_trainings, 1)
+        ratio = num_trainings_since_last_test / total_trainings[:, None]
+        new_gain = (estimated_improvement / total_trainings)[:, None]
+        blended = np.where(train_counter == 0, new_gain,
+                           (last_avg * train_counter + new_gain * ratio)
+                           / np.where(train_counter == 0, 1, train_counter + ratio))
+        trained_envs = np.flatnonzero(was_trained)
+        self.train_counter[envs[trained_envs], subject[trained_envs], :, :] += ratio[trained_envs, None, :]
+        return np.where(was_trained[:, None], blended, last_avg)
+
+    def _get_test_mean(self, envs, subject, difficulty):
+        return _get_test_mean(self.skills_levels[envs, subject], difficulty, self.difficulties_thresholds,
+                              self.review_ratio)
+
+    def _train(self, envs, subject, learning_type, learning_difficulty):
+        mean_gain = self.mean_skill_gains[envs, subject, learning_type]
+        sampled_gain = self._rng.normal(mean_gain, STUDENT_SKILL_GAIN_STD)
+        self.skills_levels[envs, subject], _ = _get_trained_skill(
+            self.skills_levels[envs, subject], sampled_gain, learning_difficulty, self.difficulties_thresholds)
+        self.cumulative_train_time[envs, subject] += (learning_type + 1)
+        self.num_trainings[envs, subject, learning_difficulty, learning_type] += 1
+        if not PROPER_LEARNING_TYPE_REWARD:
+            return np.zeros(len(envs))
+        predicted_excellence = np.argmax(self._type_sum[envs], axis=1)
+        return np.where((learning_type == self._best_learning_type[envs]) & (predicted_excellence == learning_type),
+                        PROPER_LEARNING_TYPE_REWARD, 0)
+
+    def _reset_envs(self, envs):
+        self.skills_levels[envs] = np.maximum(
+            self._rng.normal(MEAN_START_SKILL_LEVEL, STD_START_SKILL_LEVEL, size=(len(envs), self.num_subjects)), 0)
+        self.scores[envs] = 0
+        self.gains[envs] = 0
+        self.num_trainings[envs] = 0
+        self.type_gains[envs] = 0
+        for env_idx in envs:
+            self.mean_skill_gains[env_idx] = _get_mean_skills_gains(self.num_subjects, self.learning_type_number,
+                                                                    self._rng)
+        self._best_learning_type[envs] = np.argmax(self.mean_skill_gains[envs].sum(axis=1), axis=1)
+        self.cumulative_train_time[envs] = 0
+        self.train_counter[envs] = 0
+        self._type_sum[envs] = 0
+        self.episode[envs] += 1
+        self.step_num[envs] = 0
+
+    def reset(self):
+        self._reset_envs(np.arange(self.num_envs))
+        return self.observation
+
+    @property
+    def observation(self):
+        return np.concatenate([self.scores[..., None], self.gains[..., None], self.num_trainings, self.type_gains],
+                              axis=-1)
+
+    def close(self):
+        pass
+
+    def seed(self, seed=None):
+        self._rng = np.random.default_rng(seed)
+        return [seed] * self.num_envs
+
+    def get_attr(self, attr_name, indices=None):
+        value = getattr(self, attr_name)
+        if attr_name in self._BATCHED_ATTRS:
+            return [value[i] for i in self._get_indices(indices)]
+        return [value for _ in self._get_indices(indices)]
+
+    def set_attr(self, attr_name, value, indices=None):
+        indices = self._get_indices(indices)
+        if attr_name in self._BATCHED_ATTRS:
+            getattr(self, attr_name)[list(indices)] = value
+        elif self._covers_all(indices):
+            setattr(self, attr_name, value)
+        else:
+            raise ValueError(f'{attr_name} is shared by all students of StudentEnvBatched')
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        # students share one generator and the state arrays, so only methods of the whole batch can be called
+        indices = self._get_indices(indices)
+        if method_name not in self._BATCH_METHODS or not self._covers_all(indices):
+            raise ValueError(f'{method_name} cannot be called for single students of StudentEnvBatched')
+        result = getattr(self, method_name)(*method_args, **method_kwargs)
+        return [result[i] for i in indices]
+
+    def _covers_all(self, indices):
+        return sorted(indices) == list(range(self.num_envs))
+
+    def _get_indices(self, indices):
+        if indices is None:
+            return range(self.num_envs)
+        if isinstance(indices, int):
+            return [indices]
+        return indices
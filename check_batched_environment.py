@@ -0,0 +1,90 @@
+"""
+Parity check between StudentEnvBatched and independent StudentEnvs.
+
+Every student draws one normal sample per step (test score or training gain). The check feeds the same
+sample to the batched env and to the matching StudentEnv, and starts each episode from the same
+student, so both must produce the same rewards, dones and observations.
+
+Run with `python check_batched_environment.py`; it raises AssertionError on the first mismatch.
+"""
+import click
+import numpy as np
+
+from batched_environment import StudentEnvBatched
+from environment import StudentEnv
+
+
+class _FedNoise:
+    # stands in for StudentEnvBatched._rng: step draws come from `queue`, which they empty before the auto-reset,
+    # so reset draws fall through to the real generator
+    def __init__(self, rng):
+        self.rng = rng
+        self.queue = []
+
+    def normal(self, loc=0.0, scale=1.0, size=None):
+        if not self.queue:
+            return self.rng.normal(loc, scale, size)
+        loc = np.asarray(loc)
+        noise, self.queue = np.array(self.queue[:loc.size]), self.queue[loc.size:]
+        return loc + scale * noise
+
+    def random(self):
+        return self.rng.random()
+
+
+def _copy_student(batched_env, env_idx, env):
+    batched_env.skills_levels[env_idx] = env.skills_levels
+    batched_env.mean_skill_gains[env_idx] = env.mean_skill_gains
+    batched_env._best_learning_type[env_idx] = env._best_learning_type
+
+
+def check(num_envs=3, num_steps=5000, num_subjects=2, num_difficulty_levels=3, num_learning_types=3, seed=0):
+    envs = [StudentEnv(num_subjects, num_difficulty_levels, num_learning_types, seed=seed + i)
+            for i in range(num_envs)]
+    batched_env = StudentEnvBatched(num_envs, num_subjects, num_difficulty_levels, num_learning_types, seed=seed)
+    batched_env._rng = _FedNoise(batched_env._rng)
+    batched_env.reset()
+    for env_idx, env in enumerate(envs):
+        env.reset()
+        _copy_student(batched_env, env_idx, env)
+
+    rng = np.random.default_rng(seed)
+    num_done = 0
+    for step in range(num_steps):
+        actions = np.stack([env.action_space.sample() for env in envs])
+        noise = rng.standard_normal(num_envs)
+        is_test = actions[:, 0].astype(bool)
+        batched_env._rng.queue = list(noise[is_test]) + list(noise[~is_test])
+        observations, rewards, dones, infos = batched_env.step(actions)
+
+        for env_idx, env in enumerate(envs):
+            env._randn = lambda value=noise[env_idx]: value
+            observation, reward, done, _ = env.step(actions[env_idx])
+            assert bool(done) == dones[env_idx], f'done differs at step {step}, env {env_idx}'
+            assert np.isclose(reward, rewards[env_idx], rtol=1e-12, atol=1e-9), \
+                f'reward differs at step {step}, env {env_idx}: {reward} != {rewards[env_idx]}'
+            if done:
+                num_done += 1
+                # compared after reset, as DummyVecEnv and SubprocVecEnv keep the observation and then call reset
+                reset_observation = env.reset()
+                assert reset_observation is not observation, f'reset reuses the terminal observation, env {env_idx}'
+                assert np.allclose(observation, infos[env_idx]['terminal_observation'], atol=1e-5), \
+                    f'terminal observation differs at step {step}, env {env_idx}'
+                _copy_student(batched_env, env_idx, env)
+            else:
+                assert np.allclose(observation, observations[env_idx], atol=1e-5), \
+                    f'observation differs at step {step}, env {env_idx}'
+    return num_done
+
+
+@click.command()
+@click.option('--num-envs', '-n', default=3)
+@click.option('--num-steps', '-t', default=5000)
+@click.option('--seed', default=0)
+def main(num_envs, num_steps, seed):
+    num_done = check(num_envs, num_steps, seed=seed)
+    print(f'StudentEnvBatched matches StudentEnv: {num_envs} envs, {num_steps} steps, {num_done} finished episodes')
+
+
+if __name__ == '__main__':
+    main()
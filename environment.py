@@ -1,15 +1,13 @@
-import json
 import logging
 
 import gym
 from gym import spaces
 import numpy as np
+import orjson
 
-import reporting
-from utils import estimate_skills
+from kernels import estimate_subject_skill_nb, mean_type_gain_nb, proper_difficulty_nb
 import sys
 from tabulate import tabulate
-import copy
 
 MEAN_START_SKILL_LEVEL = 20
 STD_START_SKILL_LEVEL = 10
@@ -40,64 +38,66 @@ GAIN_REWARD_RATIO = 0.1
 
 PROPER_LEARNING_TYPE_REWARD = 0
 
+NOISE_BUFFER_SIZE = 4096
+
+# rendered steps are logged in batches of this many lines
+LOG_FLUSH_EVERY = 100
+
+# checking every action against the action space is slow, enable only when debugging
+VALIDATE_ACTIONS = False
+
 
 class StudentEnv(gym.Env):
-    def __init__(self, num_subjects=3, num_difficulty_levels=3, num_learning_types=3):
+    _ACTION_NAMES = ('train', 'test')
+
+    def __init__(self, num_subjects=3, num_difficulty_levels=3, num_learning_types=3, seed=None, render_every=1):
         super(StudentEnv).__init__()
-        self.action_space = spaces.MultiDiscrete([
-            2,  # train or test
-            num_subjects,  # which subject the action refers to
-            num_difficulty_levels,  # test difficulty level (not used if action=train)
-            num_learning_types,  # train type (not used if action=test)
-            num_difficulty_levels  # train difficulty level (not used if action=test)
-        ])
-        low_bound_observation_space_vector = np.array([
-            0,  # min test score
-            -100,  # min difference between previous test score and current test score (later called gain)
-            *np.repeat(0, num_learning_types),  # min number of trainings since last test for each learning type
-            *np.repeat(-100, num_learning_types),  # min gain attributed to each learning type
-        ])
-        high_bound_observation_space_vector = np.array([
-            100,  # max test score
-            100,  # max difference between previous test score and current test score (later called gain)
-            *np.repeat(sys.maxsize, num_learning_types),  # max number of trainings since last test for each learning type
-            *np.repeat(100, num_learning_types),  # max gain attributed to each learning type
-        ])
-
-        self.observation_space = spaces.Box(
-            low=np.tile(low_bound_observation_space_vector, (num_subjects, num_difficulty_levels, 1)),
-            high=np.tile(high_bound_observation_space_vector, (num_subjects, num_difficulty_levels, 1))
-        )
+        self.seed(seed)
+        self.action_space = _get_action_space(num_subjects, num_difficulty_levels, num_learning_types)
+        self.observation_space = _get_observation_space(num_subjects, num_difficulty_levels, num_learning_types)
         self.difficulties_levels = num_difficulty_levels
         self.learning_type_number = num_learning_types
         self.num_subjects = num_subjects
         self.skills_levels = np.maximum(
-            np.random.normal(MEAN_START_SKILL_LEVEL, STD_START_SKILL_LEVEL, size=num_subjects), 0
+            self._rng.normal(MEAN_START_SKILL_LEVEL, STD_START_SKILL_LEVEL, size=num_subjects), 0
         )
-        self.last_scores = np.zeros(shape=(num_subjects, num_difficulty_levels, 2 * num_learning_types + 2))
-        self.mean_skill_gains = _get_mean_skills_gains(num_subjects, num_learning_types)
+        # observation fields are kept in separate float32 arrays, see the observation property
+        self.scores = np.zeros((num_subjects, num_difficulty_levels), dtype=np.float32)
+        self.gains = np.zeros((num_subjects, num_difficulty_levels), dtype=np.float32)
+        self.num_trainings = np.zeros((num_subjects, num_difficulty_levels, num_learning_types), dtype=np.float32)
+        self.type_gains = np.zeros((num_subjects, num_difficulty_levels, num_learning_types), dtype=np.float32)
+        self._observation = np.zeros((num_subjects, num_difficulty_levels, 2 * num_learning_types + 2),
+                                     dtype=np.float32)
+        self.mean_skill_gains = _get_mean_skills_gains(num_subjects, num_learning_types, self._rng)
+        self._best_learning_type = int(np.argmax(self.mean_skill_gains.sum(axis=0)))
         self.difficulties_thresholds = np.linspace(0, 100, num=num_difficulty_levels, endpoint=False)
+        self.difficulties_thresholds.setflags(write=False)
         self.review_ratio = 1 / (num_difficulty_levels + 1)
         self.cumulative_train_time = np.zeros(num_subjects)
         self.train_counter = np.zeros((num_subjects, num_difficulty_levels, num_learning_types))
+        # sum of gains attributed to each learning type, only kept up to date when it affects the reward
+        self._type_sum = np.zeros(num_learning_types)
         self.episode = 0
         self.step_num = 0
-        self.last_action = None
+        # reused across steps, see _set_last_action
+        self.last_action = {}
+        self.render_every = render_every
+        self._log_buffer = []
+        # compile numba kernels here rather than on the first step
+        estimate_subject_skill_nb(self.scores[0], REVIEW_RATIO)
+        mean_type_gain_nb(self.type_gains[0, 0], np.ones(num_learning_types), self.num_trainings[0, 0], 0.)
+        proper_difficulty_nb(0., self.difficulties_thresholds)
 
     def step(self, action):
-        assert self.action_space.contains(action)
+        if VALIDATE_ACTIONS:
+            assert self.action_space.contains(action)
         is_test, subject, test_difficulty, learning_types, learning_difficulty = action
-        difficulty_to_log = test_difficulty if is_test else learning_difficulty
-        self.last_action = {
-            'action': ['train', 'test'][is_test],
-            'subject': subject + 1,
-            'difficulty': difficulty_to_log + 1
-        }
+        self._set_last_action(is_test, subject, test_difficulty if is_test else learning_difficulty)
 
         if is_test:
             reward = self._test(subject, test_difficulty)
             self.cumulative_train_time[subject] = 0
-            if (self.last_scores[:, -1, 0] > TARGET_SCORE).all():
+            if (self.scores[:, -1] > TARGET_SCORE).all():
                 is_done = 1
                 reward += REWARD_FOR_ACHIEVING_ALL_LEVELS
             else:
@@ -108,98 +108,67 @@ class StudentEnv(gym.Env):
         reward += - np.sqrt(self.step_num)
         self.last_action['reward'] = reward
         self.step_num += 1
-        return self.last_scores, reward, is_done, {}
+        return self.observation, reward, is_done, {}
+
+    def _set_last_action(self, is_test, subject, difficulty):
+        self.last_action.clear()
+        self.last_action['action'] = self._ACTION_NAMES[is_test]
+        self.last_action['subject'] = int(subject) + 1
+        self.last_action['difficulty'] = int(difficulty) + 1
 
     def _test(self, subject, difficulty):
         test_mean = self._get_test_mean(subject, difficulty)
-        previous_score = self.last_scores[subject, difficulty, 0]
-        previous_scores = copy.copy(self.last_scores[:, :, 0])
-        sampled_test_score = min(max(np.random.normal(test_mean, TEST_SCORE_STD), 0), 100)
-        self.last_scores[subject, difficulty, 1] = sampled_test_score - previous_score
-        self.last_scores[subject, difficulty, 0] = sampled_test_score
-        estimated_improvement = estimate_skills(self.last_scores[:, :, 0], REVIEW_RATIO)[subject] - \
-                                estimate_skills(previous_scores, REVIEW_RATIO)[subject]
+        previous_score = self.scores[subject, difficulty]
+        previous_estimated_skill = estimate_subject_skill_nb(self.scores[subject], REVIEW_RATIO)
+        sampled_test_score = min(max(test_mean + TEST_SCORE_STD * self._randn(), 0), 100)
+        self.gains[subject, difficulty] = sampled_test_score - previous_score
+        self.scores[subject, difficulty] = sampled_test_score
+        estimated_improvement = estimate_subject_skill_nb(self.scores[subject], REVIEW_RATIO) - \
+                                previous_estimated_skill
         mean_type_gain = self._get_mean_type_gain(subject, difficulty, estimated_improvement)
-        for d in range(self.difficulties_levels):
-            self.last_scores[subject, d, -self.learning_type_number:] = mean_type_gain
-            for s in range(self.num_subjects):
-                self.last_scores[s, d, -self.learning_type_number:] = \
-                    np.average([self.last_scores[s, d, -self.learning_type_number:], mean_type_gain],
-                               weights=[1, 0.5], axis=0)
-
-        self.last_scores[subject, difficulty, 2:2 + self.learning_type_number] = 0
-        self.last_action['test_score'] = self.last_scores[subject, difficulty, 0]
-        if not self.cumulative_train_time[subject]:
-            return TIME_PENALTY_FOR_TEST
-        if self.last_scores[subject, difficulty, 0] >= TARGET_SCORE:
-            # if not self.skills_level_achieved[subject] and difficulty+1 == self.difficulties_level_nb:
-            if previous_score < TARGET_SCORE:
-                return REWARD_FOR_ACHIEVING_TARGET_LEVEL * (difficulty + 1) / self.difficulties_levels
-            else:
-                return PENALTY_FOR_UNNECESSARY_TEST
-        return GAIN_MULTIPLIER_FOR_TEST * (1 / np.sqrt(self.step_num+1)) * (
-                    (self.last_scores[subject, difficulty, 0] - previous_score)
-                    / self.cumulative_train_time[subject]) + TIME_PENALTY_FOR_TEST
+        self.type_gains[subject, :, :] = mean_type_gain
+        self.type_gains[:] = (self.type_gains + 0.5 * mean_type_gain) / 1.5
+        if PROPER_LEARNING_TYPE_REWARD:
+            self._type_sum = self.type_gains.sum(axis=(0, 1))
+
+        self.num_trainings[subject, difficulty] = 0
+        self.last_action['test_score'] = self.scores[subject, difficulty]
+        return float(_get_test_reward(sampled_test_score, previous_score, self.cumulative_train_time[subject],
+                                      difficulty, self.difficulties_levels, self.step_num))
 
     def _get_mean_type_gain(self, subject, difficulty, estimated_improvement):
-        num_trainings_since_last_test = self.last_scores[subject, difficulty, 2:2 + self.learning_type_number]
-        if np.sum(num_trainings_since_last_test) > 0:
-            ratio = num_trainings_since_last_test / np.sum(num_trainings_since_last_test)
-            new_gain = estimated_improvement / np.sum(num_trainings_since_last_test)
-            result = -np.ones(self.learning_type_number)
-            for idx, elem in enumerate(
-                    zip(self.last_scores[subject, difficulty, -self.learning_type_number:], ratio)):
-                last_avg, ratio = elem
-                if self.train_counter[subject, difficulty, idx] == 0:
-                    result[idx] = new_gain
-                else:
-                    result[idx] = np.average([last_avg, new_gain],
-                                             weights=[self.train_counter[subject, difficulty, idx],
-                                                      ratio])
-            for d in range(self.learning_type_number):
-                self.train_counter[subject, d, :] += ratio
+        num_trainings_since_last_test = self.num_trainings[subject, difficulty]
+        total_trainings = num_trainings_since_last_test.sum()
+        if total_trainings > 0:
+            ratio = num_trainings_since_last_test / total_trainings
+            new_gain = estimated_improvement / total_trainings
+            result = mean_type_gain_nb(self.type_gains[subject, difficulty], self.train_counter[subject, difficulty],
+                                       ratio, new_gain)
+            self.train_counter[subject, :, :] += ratio[None, :]
             return result
         else:
-            return self.last_scores[subject, difficulty, -self.learning_type_number:]
+            return self.type_gains[subject, difficulty]
 
     def _get_test_mean(self, subject, difficulty):
-        proper_difficulty = self._get_proper_difficulty(self.skills_levels[subject])
-        if proper_difficulty < difficulty:
-            return self._get_too_hard_test_mean(subject, difficulty, proper_difficulty)
-        if proper_difficulty > difficulty:
-            return 100
-        return self._get_proper_test_mean(subject, difficulty)
-
-    def _get_too_hard_test_mean(self, subject, difficulty, proper_difficulty):
-        review_mean = self._get_scaled_mean_score(subject, proper_difficulty)
-        return self.review_ratio ** (difficulty - proper_difficulty) * review_mean
-
-    def _get_proper_test_mean(self, subject, difficulty):
-        proper_mean = self._get_scaled_mean_score(subject, difficulty)
-        review_score = self.review_ratio if difficulty else 0
-        return review_score*100 + proper_mean*(1-review_score)
-
-    def _get_scaled_mean_score(self, subject, difficulty):
-        return (self.skills_levels[subject] - self.difficulties_thresholds[difficulty]) * self.difficulties_levels
+        return _get_test_mean(self.skills_levels[subject], difficulty, self.difficulties_thresholds, self.review_ratio)
 
     def _train(self, subject, learning_type, learning_difficulty):
         mean_gain = self.mean_skill_gains[subject, learning_type]
-        sampled_gain = np.random.normal(mean_gain, STUDENT_SKILL_GAIN_STD)
-        adjusted_gain = sampled_gain * self._get_not_adapted_learning_penalty(
-            self.skills_levels[subject], learning_difficulty)
-        adjusted_gain = max(adjusted_gain, 0)
-        self.skills_levels[subject] += adjusted_gain
-        self.skills_levels[subject] = min(self.skills_levels[subject], 100)
-        self.last_action['improvement'] = max(adjusted_gain, 0)
+        sampled_gain = mean_gain + STUDENT_SKILL_GAIN_STD * self._randn()
+        self.skills_levels[subject], adjusted_gain = _get_trained_skill(
+            self.skills_levels[subject], sampled_gain, learning_difficulty, self.difficulties_thresholds)
+        self.last_action['improvement'] = adjusted_gain
         self.last_action['learning_type'] = learning_type + 1
         self.cumulative_train_time[subject] += (learning_type + 1)
-        self.last_scores[subject, learning_difficulty, 2 + learning_type] += 1
-        estimated_skill = estimate_skills(self.last_scores[:, :, 0], REVIEW_RATIO)[subject]
+        self.num_trainings[subject, learning_difficulty, learning_type] += 1
+        if not PROPER_LEARNING_TYPE_REWARD:
+            return 0
+        estimated_skill = estimate_subject_skill_nb(self.scores[subject], REVIEW_RATIO)
         estimated_penalty = self._get_not_adapted_learning_penalty(estimated_skill, learning_difficulty)
         estimated_gain = POPULATION_MEAN_SKILL_GAIN * learning_type
         adapted_learning_reward = estimated_penalty * estimated_gain * GAIN_REWARD_RATIO
-        predicted_excellence = np.argmax(np.sum(self.last_scores[:,:,-self.learning_type_number:], axis=(0, 1)))
-        if learning_type == np.argmax(np.sum(self.mean_skill_gains, axis=0)) and predicted_excellence == learning_type:
+        predicted_excellence = int(np.argmax(self._type_sum))
+        if learning_type == self._best_learning_type and predicted_excellence == learning_type:
             return PROPER_LEARNING_TYPE_REWARD #* 1/np.sqrt(self.step_num+1)
         return 0
         # return 0 - (learning_type + 1) + adapted_learning_reward
@@ -209,44 +178,162 @@ class StudentEnv(gym.Env):
         return NOT_ADAPTED_DIFFICULTY_PENALTY ** abs(learning_difficulty - proper_difficulty)
 
     def _get_proper_difficulty(self, skill):
-        return sum(self.difficulties_thresholds <= skill) - 1
-
-    def reset(self):
+        return proper_difficulty_nb(skill, self.difficulties_thresholds)
+
+    def seed(self, seed=None):
+        self._rng = np.random.default_rng(seed)
+        self._noise_buf = self._rng.standard_normal(NOISE_BUFFER_SIZE)
+        self._noise_idx = 0
+        return [seed]
+
+    def _randn(self):
+        # standard normal samples are drawn in bulk, scalar draws through the generator are slow
+        if self._noise_idx == NOISE_BUFFER_SIZE:
+            self._rng.standard_normal(out=self._noise_buf)
+            self._noise_idx = 0
+        self._noise_idx += 1
+        return self._noise_buf[self._noise_idx - 1]
+
+    def reset(self, seed=None):
+        self._flush_log()
+        if seed is not None:
+            self.seed(seed)
         self.skills_levels = np.maximum(
-            np.random.normal(MEAN_START_SKILL_LEVEL, STD_START_SKILL_LEVEL, size=len(self.skills_levels)),
+            self._rng.normal(MEAN_START_SKILL_LEVEL, STD_START_SKILL_LEVEL, size=len(self.skills_levels)),
             np.zeros_like(self.skills_levels)
         )
-        self.last_scores = np.zeros_like(self.last_scores)
-        self.mean_skill_gains = _get_mean_skills_gains(*self.mean_skill_gains.shape)
-        self.difficulties_thresholds = np.linspace(0, 100, num=self.difficulties_levels, endpoint=False)
+        self.scores = np.zeros_like(self.scores)
+        self.gains = np.zeros_like(self.gains)
+        self.num_trainings = np.zeros_like(self.num_trainings)
+        self.type_gains = np.zeros_like(self.type_gains)
+        # a new buffer, so the last observation of the finished episode is not overwritten
+        self._observation = np.zeros_like(self._observation)
+        self.mean_skill_gains = _get_mean_skills_gains(*self.mean_skill_gains.shape, self._rng)
+        self._best_learning_type = int(np.argmax(self.mean_skill_gains.sum(axis=0)))
         self.cumulative_train_time = np.zeros_like(self.cumulative_train_time)
         self.train_counter = np.zeros_like(self.train_counter)
+        self._type_sum = np.zeros_like(self._type_sum)
         self.episode += 1
         self.step_num = 0
-        return self.last_scores
+        return self.observation
+
+    @property
+    def observation(self):
+        # (num_subjects, num_difficulty_levels, 2 + 2 * num_learning_types) layout expected by the policy
+        self._observation[:, :, 0] = self.scores
+        self._observation[:, :, 1] = self.gains
+        self._observation[:, :, 2:2 + self.learning_type_number] = self.num_trainings
+        self._observation[:, :, -self.learning_type_number:] = self.type_gains
+        return self._observation
 
     def render(self, mode='human'):
+        if self.step_num % self.render_every == 0:
+            self._print_table()
+        return self.log_step()
+
+    def log_step(self):
+        self._log({**self.last_action, 'skills': self.skills_levels, 'step': self.step_num,
+                   'episode': self.episode, 'env': self._get_log_env_name()})
+        return self.last_action
+
+    def _print_table(self):
         action_to_str = ';'.join(f'{k}={v}' for k, v in self.last_action.items())
-        last_scores = self.last_scores
-        types = {f'Learning type number {i + 1}': last_scores[:, :, -self.learning_type_number + i].round(3)
+        rounded_types = self.type_gains.round(3)
+        types = {f'Learning type number {i + 1}': rounded_types[:, :, i]
                  for i in range(self.learning_type_number)}
-        table = {'Test matrix': last_scores[:, :, 0].round(1)}
+        table = {'Test matrix': self.scores.round(1)}
         table.update(types)
         if self.last_action['action'] == 'test':
-            table.update({f'Train counters {i + 1}': last_scores[:, :, 2 + i].round(3)
+            rounded_counters = self.num_trainings.round(3)
+            table.update({f'Train counters {i + 1}': rounded_counters[:, :, i]
                           for i in range(self.learning_type_number)})
         print(f'***\n'
               f'Action: {action_to_str}\n' +
               tabulate(table, headers='keys') + '\n'
               f'Latent skill level: {self.skills_levels.round(1)}\n'
                                                 f'***')
-        logging.info(json.dumps({**self.last_action, 'skills': self.skills_levels, 'step': self.step_num,
-                                 'episode': self.episode, 'env': 'original'},
-                                cls=reporting.NpEncoder))
-        return self.last_action
+
+    def _get_log_env_name(self):
+        return 'original'
+
+    def _log(self, entry):
+        self._log_buffer.append(orjson.dumps(entry, option=orjson.OPT_SERIALIZE_NUMPY).decode())
+        if len(self._log_buffer) >= LOG_FLUSH_EVERY:
+            self._flush_log()
+
+    def _flush_log(self):
+        if self._log_buffer:
+            logging.info('\n'.join(self._log_buffer))
+            self._log_buffer = []
+
+    def close(self):
+        self._flush_log()
+
+
+def _get_action_space(num_subjects, num_difficulty_levels, num_learning_types):
+    return spaces.MultiDiscrete([
+        2,  # train or test
+        num_subjects,  # which subject the action refers to
+        num_difficulty_levels,  # test difficulty level (not used if action=train)
+        num_learning_types,  # train type (not used if action=test)
+        num_difficulty_levels  # train difficulty level (not used if action=test)
+    ])
+
+
+def _get_observation_space(num_subjects, num_difficulty_levels, num_learning_types):
+    low_bound_observation_space_vector = np.array([
+        0,  # min test score
+        -100,  # min difference between previous test score and current test score (later called gain)
+        *np.repeat(0, num_learning_types),  # min number of trainings since last test for each learning type
+        *np.repeat(-100, num_learning_types),  # min gain attributed to each learning type
+    ])
+    high_bound_observation_space_vector = np.array([
+        100,  # max test score
+        100,  # max difference between previous test score and current test score (later called gain)
+        *np.repeat(sys.maxsize, num_learning_types),  # max number of trainings since last test for each learning type
+        *np.repeat(100, num_learning_types),  # max gain attributed to each learning type
+    ])
+    return spaces.Box(
+        low=np.tile(low_bound_observation_space_vector, (num_subjects, num_difficulty_levels, 1)),
+        high=np.tile(high_bound_observation_space_vector, (num_subjects, num_difficulty_levels, 1))
+    )
+
+
+# The env dynamics below are pure and branchless: they take scalars or arrays (one entry per student)
+# and select between cases with np.where, so the same code serves StudentEnv and StudentEnvBatched.
+def _get_test_mean(skill, difficulty, thresholds, review_ratio):
+    difficulties_levels = len(thresholds)
+    proper_difficulty = proper_difficulty_nb(skill, thresholds)
+    review_mean = (skill - thresholds[proper_difficulty]) * difficulties_levels
+    too_hard_mean = review_ratio ** (difficulty - proper_difficulty) * review_mean
+    review_score = np.where(difficulty > 0, review_ratio, 0)
+    proper_mean = review_score * 100 + (skill - thresholds[difficulty]) * difficulties_levels * (1 - review_score)
+    return np.where(proper_difficulty < difficulty, too_hard_mean,
+                    np.where(proper_difficulty > difficulty, 100, proper_mean))
+
+
+def _get_test_reward(test_score, previous_score, cumulative_train_time, difficulty, difficulties_levels, step_num):
+    if GAIN_MULTIPLIER_FOR_TEST:
+        gain_reward = GAIN_MULTIPLIER_FOR_TEST * (1 / np.sqrt(step_num + 1)) * (
+                (test_score - previous_score)
+                / np.where(cumulative_train_time, cumulative_train_time, 1)) + TIME_PENALTY_FOR_TEST
+    else:
+        gain_reward = TIME_PENALTY_FOR_TEST
+    target_reward = np.where(previous_score < TARGET_SCORE,
+                             REWARD_FOR_ACHIEVING_TARGET_LEVEL * (difficulty + 1) / difficulties_levels,
+                             PENALTY_FOR_UNNECESSARY_TEST)
+    return np.where(cumulative_train_time == 0, TIME_PENALTY_FOR_TEST,
+                    np.where(test_score >= TARGET_SCORE, target_reward, gain_reward))
 
 
-def _get_mean_skills_gains(subjects_number, learning_types_number):
+def _get_trained_skill(skill, sampled_gain, learning_difficulty, thresholds):
+    proper_difficulty = proper_difficulty_nb(skill, thresholds)
+    adjusted_gain = np.maximum(
+        sampled_gain * NOT_ADAPTED_DIFFICULTY_PENALTY ** np.abs(learning_difficulty - proper_difficulty), 0)
+    return np.minimum(skill + adjusted_gain, 100), adjusted_gain
+
+
+def _get_mean_skills_gains(subjects_number, learning_types_number, rng=np.random):
     # skill_gain_matrix = np.tile(np.random.normal(POPULATION_MEAN_SKILL_GAIN, POPULATION_STD_SKILL_GAIN,
     #                                              size=(learning_types_number)), (subjects_number, 1))
     # skill_gain_matrix += np.random.normal(0, POPULATION_STD_TYPE_GAIN, size=(subjects_number, learning_types_number))
@@ -255,22 +342,11 @@ def _get_mean_skills_gains(subjects_number, learning_types_number):
     #     np.full(shape=(subjects_number, learning_types_number), fill_value=POPULATION_MIN_SKILL_GAIN)
     # )
 
-    if np.random.random()>0.5:
-        excellence_skills = np.tile(
-            np.concatenate(([np.random.normal(3, 0.2)], np.random.normal(0.3, 0.1, 2))), (3, 1))
-        excellence_skills += np.random.normal(0, 0.05, size=(3, 3))
-        excellence_skills = np.maximum(
-            excellence_skills,
-            np.full(shape=(3, 3), fill_value=0.05)
-        )
+    if rng.random()>0.5:
+        type_gains = rng.normal([3, 0.3, 0.3], [0.2, 0.1, 0.1])
     else:
-        excellence_skills = np.tile(
-            np.concatenate((np.random.normal(0.2, 0.1, 2), [np.random.normal(3, 0.2)])), (3, 1))
-        excellence_skills += np.random.normal(0, 0.05, size=(3, 3))
-        excellence_skills = np.maximum(
-            excellence_skills,
-            np.full(shape=(3, 3), fill_value=0.05)
-        )
+        type_gains = rng.normal([0.2, 0.2, 3], [0.1, 0.1, 0.2])
+    excellence_skills = np.maximum(type_gains[None, :] + rng.normal(0, 0.05, size=(3, 3)), 0.05)
     interval_mean_skill_gains = excellence_skills
     return interval_mean_skill_gains
 
@@ -281,61 +357,48 @@ class StudentEnvBypass(StudentEnv):
                                                                   studentenvcopy.difficulties_levels, \
                                                                   studentenvcopy.learning_type_number
         super(StudentEnvBypass, self).__init__(num_subjects, num_difficulty_levels, num_learning_types)
-        self.last_scores = copy.deepcopy(studentenvcopy.last_scores)
-        self.cumulative_train_time = copy.deepcopy(studentenvcopy.cumulative_train_time)
-        self.train_counter = copy.deepcopy(studentenvcopy.train_counter)
-        self.episode = copy.deepcopy(studentenvcopy.episode)
-        self.step_num = copy.deepcopy(studentenvcopy.step_num)
+        self.scores = studentenvcopy.scores.copy()
+        self.gains = studentenvcopy.gains.copy()
+        self.num_trainings = studentenvcopy.num_trainings.copy()
+        self.type_gains = studentenvcopy.type_gains.copy()
+        self.cumulative_train_time = studentenvcopy.cumulative_train_time.copy()
+        self.train_counter = studentenvcopy.train_counter.copy()
+        self._type_sum = studentenvcopy._type_sum.copy()
+        self.episode = studentenvcopy.episode
+        self.step_num = studentenvcopy.step_num
         self.prob_ratio = prob_ratio if prob_ratio else [0.8, 0.1, 0.1]
-        self.mean_skill_gains = copy.deepcopy(studentenvcopy.mean_skill_gains)
-        self.skills_levels = copy.deepcopy(studentenvcopy.skills_levels)
+        self.render_every = studentenvcopy.render_every
+        self.mean_skill_gains = studentenvcopy.mean_skill_gains.copy()
+        self._best_learning_type = studentenvcopy._best_learning_type
+        self.skills_levels = studentenvcopy.skills_levels.copy()
+
+    @classmethod
+    def from_params(cls, num_subjects=3, num_difficulty_levels=3, num_learning_types=3, prob_ratio=None):
+        # builds the env from a fresh StudentEnv, e.g. for SubprocVecEnv factories
+        return cls(StudentEnv(num_subjects, num_difficulty_levels, num_learning_types), prob_ratio)
 
     def step(self, action):
-        assert self.action_space.contains(action)
+        if VALIDATE_ACTIONS:
+            assert self.action_space.contains(action)
         is_test, subject, test_difficulty, learning_types, learning_difficulty = action
-        difficulty_to_log = test_difficulty if is_test else learning_difficulty
-        self.last_action = {
-            'action': ['train', 'test'][is_test],
-            'subject': subject + 1,
-            'difficulty': difficulty_to_log + 1
-        }
+        self._set_last_action(is_test, subject, test_difficulty if is_test else learning_difficulty)
 
         if is_test:
             reward = self._test(subject, test_difficulty)
             self.cumulative_train_time[subject] = 0
-            if (self.last_scores[:, -1, 0] > TARGET_SCORE).all():
+            if (self.scores[:, -1] > TARGET_SCORE).all():
                 is_done = 1
                 reward += REWARD_FOR_ACHIEVING_ALL_LEVELS
             else:
                 is_done = 0
         else:
-            learning_types = int(np.random.choice(self.difficulties_levels, p=self.prob_ratio))
+            learning_types = int(self._rng.choice(self.difficulties_levels, p=self.prob_ratio))
             reward = self._train(subject, learning_types, learning_difficulty)
             is_done = 0
         reward += - np.sqrt(self.step_num)
         self.last_action['reward'] = reward
         self.step_num += 1
-        return self.last_scores, reward, is_done, {}
-
-    def render(self, mode='human'):
-        action_to_str = ';'.join(f'{k}={v}' for k, v in self.last_action.items())
-        last_scores = self.last_scores
-        types = {f'Learning type number {i + 1}': last_scores[:, :, -self.learning_type_number + i].round(3)
-                 for i in range(self.learning_type_number)}
-        table = {'Test matrix': last_scores[:, :, 0].round(1)}
-        table.update(types)
-        if self.last_action['action'] == 'test':
-            table.update({f'Train counters {i + 1}': last_scores[:, :, 2 + i].round(3)
-                          for i in range(self.learning_type_number)})
-        print(f'***\n'
-              f'Action: {action_to_str}\n' +
-              tabulate(table, headers='keys') + '\n'
-              f'Latent skill level: {self.skills_levels.round(1)}\n'
-                                                f'***')
-        logging.info(json.dumps({**self.last_action, 'skills': self.skills_levels, 'step': self.step_num,
-                                 'episode': self.episode,
-                                 'env': f'bias for {np.argmax(self.prob_ratio)+1} learning type'},
-                                cls=reporting.NpEncoder))
-        return self.last_action
-
+        return self.observation, reward, is_done, {}
 
+    def _get_log_env_name(self):
+        return f'bias for {np.argmax(self.prob_ratio)+1} learning type'
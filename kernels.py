@@ -0,0 +1,48 @@
+import numpy as np
+from numba import njit
+
+
+@njit(cache=True)
+def estimate_skill_nb(test_score, lower_bound, upper_bound, review_ratio):
+    # iterative version of utils.estimate_skill
+    max_points = 100.
+    while test_score - max_points * review_ratio < 0:
+        if lower_bound <= 0:
+            return (test_score / 100) * upper_bound
+        interval_range = upper_bound - lower_bound
+        lower_bound -= interval_range
+        upper_bound -= interval_range
+        max_points = 25.
+    return lower_bound + (test_score / 100) * (upper_bound - lower_bound)
+
+
+@njit(cache=True)
+def estimate_subject_skill_nb(subject_test_scores, review_ratio):
+    interval_range = 100 / len(subject_test_scores)
+    best = -np.inf
+    for j in range(len(subject_test_scores)):
+        start = j * interval_range
+        best = max(best, estimate_skill_nb(subject_test_scores[j], start, start + interval_range, review_ratio))
+    return best
+
+
+@njit(cache=True)
+def estimate_skills_nb(test_scores, review_ratio):
+    result = np.empty(test_scores.shape[0])
+    for i in range(test_scores.shape[0]):
+        result[i] = estimate_subject_skill_nb(test_scores[i], review_ratio)
+    return result
+
+
+@njit(cache=True)
+def mean_type_gain_nb(last_avg, train_counter_row, ratio, new_gain):
+    not_trained = train_counter_row == 0
+    blended = (last_avg * train_counter_row + new_gain * ratio) \
+        / np.where(not_trained, np.ones(len(ratio)), train_counter_row + ratio)
+    return np.where(not_trained, np.full(len(ratio), new_gain), blended)
+
+
+@njit(cache=True)
+def proper_difficulty_nb(skill, thresholds):
+    # thresholds are sorted, so this is the number of thresholds <= skill, minus one
+    return np.searchsorted(thresholds, skill, side='right') - 1
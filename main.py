@@ -1,9 +1,12 @@
 import json
+import os
 
 import click
 from stable_baselines.common.policies import MlpPolicy
+from stable_baselines.common.vec_env import SubprocVecEnv
 from stable_baselines import TRPO, PPO2
 
+from batched_environment import StudentEnvBatched
 from environment import StudentEnv
 from reporting import setup_logging
 
@@ -13,6 +16,9 @@ SUPPORTED_MODEL_TYPES = {
     'trpo': TRPO,
 }
 
+# TRPO parallelizes with MPI and only accepts a single environment
+VEC_ENV_MODEL_TYPES = {'ppo2'}
+
 
 @click.group()
 def cli():
@@ -26,13 +32,24 @@ def cli():
 @click.option('--num-difficulty-levels', '-d', default=3)
 @click.option('--num-learning-types', '-l', default=3)
 @click.option('--training-steps', '-t', default=250000)
-def train(model_type, output_path, num_subjects, num_difficulty_levels, num_learning_types, training_steps):
+@click.option('--n-envs', '-n', default=os.cpu_count(), help='parallel environments, ignored for trpo')
+@click.option('--batched/--subprocess', default=False,
+              help='step all environments in one process with StudentEnvBatched instead of one process each')
+def train(model_type, output_path, num_subjects, num_difficulty_levels, num_learning_types, training_steps, n_envs,
+          batched):
     model_class = SUPPORTED_MODEL_TYPES[model_type]
-    env = StudentEnv(num_subjects, num_difficulty_levels, num_learning_types)
+    if model_type not in VEC_ENV_MODEL_TYPES or n_envs == 1:
+        env = StudentEnv(num_subjects, num_difficulty_levels, num_learning_types)
+    elif batched:
+        env = StudentEnvBatched(n_envs, num_subjects, num_difficulty_levels, num_learning_types)
+    else:
+        env = SubprocVecEnv([lambda: StudentEnv(num_subjects, num_difficulty_levels, num_learning_types)
+                             for _ in range(n_envs)])
 
     model = model_class(MlpPolicy, env, verbose=1, gamma=0.9)
     model.learn(total_timesteps=training_steps)
     model.save(output_path)
+    env.close()
     with open(output_path + '.metadata', 'w') as outfile:
         json.dump({
             'model_type': model_type,
@@ -47,7 +64,10 @@ def train(model_type, output_path, num_subjects, num_difficulty_levels, num_lear
 @click.option('--num-episodes', '-e', default=200)
 @click.option('--num-steps', '-s', default=20000)
 @click.option('--logging-path')
-def test(model_path, num_episodes, num_steps, logging_path):
+@click.option('--render/--no-render', default=False)
+@click.option('--verbose/--quiet', default=False)
+@click.option('--log-steps/--no-log-steps', default=True)
+def test(model_path, num_episodes, num_steps, logging_path, render, verbose, log_steps):
     with open(model_path + '.metadata') as outfile:
         metadata = json.load(outfile)
 
@@ -55,7 +75,7 @@ def test(model_path, num_episodes, num_steps, logging_path):
 
     model = SUPPORTED_MODEL_TYPES[metadata['model_type']].load(model_path)
     env = StudentEnv(num_subjects=metadata['num_subjects'])
-    _run_env(model, env, num_episodes, num_steps)
+    _run_env(model, env, num_episodes, num_steps, render, verbose, log_steps)
 
 
 @cli.command()
@@ -63,24 +83,28 @@ def test(model_path, num_episodes, num_steps, logging_path):
 @click.option('--num-episodes', '-e', default=200)
 @click.option('--num-steps', '-s', default=20000)
 @click.option('--logging-path')
-def test_random(metadata_path, num_episodes, num_steps, logging_path):
+@click.option('--render/--no-render', default=False)
+@click.option('--verbose/--quiet', default=False)
+@click.option('--log-steps/--no-log-steps', default=True)
+def test_random(metadata_path, num_episodes, num_steps, logging_path, render, verbose, log_steps):
     with open(metadata_path) as outfile:
         metadata = json.load(outfile)
 
     setup_logging(logging_path or f'random.log')
 
     env = StudentEnv(metadata['num_subjects'], metadata['num_difficulty_levels'], metadata['num_learning_types'])
-    _run_env(None, env, num_episodes, num_steps)
+    _run_env(None, env, num_episodes, num_steps, render, verbose, log_steps)
 
 
-def _run_env(model, env, num_episodes, num_steps):
+def _run_env(model, env, num_episodes, num_steps, render=False, verbose=False, log_steps=True):
     for ep in range(num_episodes):
-        i = _run_episode(model, env, num_steps)
+        i = _run_episode(model, env, num_steps, render, verbose, log_steps)
         print(ep, i)
         print(env.mean_skill_gains)
+    env.close()
 
 
-def _run_episode(model, env, num_steps):
+def _run_episode(model, env, num_steps, render=False, verbose=False, log_steps=True):
     obs = env.reset()
     for i in range(num_steps):
         if model is None:
@@ -88,8 +112,12 @@ def _run_episode(model, env, num_steps):
         else:
             action, _states = model.predict(obs)
         obs, rewards, done, info = env.step(action)
-        print(i)
-        env.render()
+        if verbose and i % 1000 == 0:
+            print(i)
+        if render:
+            env.render()
+        elif log_steps:
+            env.log_step()
         if done:
             return i
 